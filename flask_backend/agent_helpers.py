@@ -0,0 +1,651 @@
+import os
+import re
+import time
+import asyncio
+import logging
+import itertools
+import threading
+from concurrent.futures import Future
+from urllib.parse import urlencode
+
+import httpx
+import orjson
+from dotenv import load_dotenv
+from websockets.asyncio.client import connect as websocket_connect
+from websockets.exceptions import ConnectionClosed
+from websockets.protocol import State
+
+try:
+    import groq
+except ImportError:
+    # Fallback to openai-style client if groq not installed
+    import openai as groq
+
+from elevenlabs.client import AsyncElevenLabs, ElevenLabs
+
+from caching import AudioCache, RecentResults, SemanticResponseCache, audio_cache_key, audio_digest
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Initialize API keys and clients
+DEEPGRAM_API_KEY = os.getenv("DEEPGRAM_API_KEY")
+DEEPGRAM_AVAILABLE = bool(DEEPGRAM_API_KEY)
+ELEVENLABS_API_KEY = os.getenv("ELEVENLABS_API_KEY")
+ELEVENLABS_VOICE_ID = os.getenv("ELEVENLABS_VOICE_ID", "21m00Tcm4TlvDq8ikWAM")  # Default to Rachel
+ELEVENLABS_MODEL_ID = os.getenv("ELEVENLABS_MODEL_ID", "eleven_turbo_v2")  # Low-latency streaming model
+ELEVENLABS_OUTPUT_FORMAT = "mp3_22050_32"
+ELEVENLABS_PCM_FORMAT = "pcm_16000"  # Raw audio for the agent's WebRTC track
+PCM_FRAME_BYTES = 640  # 20 ms of 16 kHz mono PCM16, LiveKit's packet size
+TTS_CONCURRENCY = 3  # ElevenLabs streams open at once per conversation turn
+GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+
+# Prompts and request options are built once at import, so every request sends
+# a byte-identical prompt prefix that Groq's prompt cache can reuse
+SYSTEM_PROMPT = {
+    "role": "system",
+    "content": "You are a helpful voice assistant that provides concise, accurate responses."
+}
+PROMPT_TEMPLATE = """You are a helpful voice assistant for a small business.
+The user said: '{transcription}'
+
+Respond naturally and concisely, keeping your response under 3 sentences when possible.
+"""
+LLM_MODEL = "llama3-8b-8192"  # Use Llama 3 8B model for a good balance of quality and speed
+LLM_MAX_TOKENS = 300
+LLM_TEMPERATURE = 0.7
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
+LLM_OPTIONS = {"model": LLM_MODEL, "max_tokens": LLM_MAX_TOKENS, "temperature": LLM_TEMPERATURE}
+
+# Recorded audio is posted to Deepgram's REST endpoint over the shared HTTP
+# clients (the SDK opens a new connection for every request); the agent sends
+# raw PCM directly, without wrapping it in a WAV container first
+DEEPGRAM_API_URL = "https://api.deepgram.com/v1/listen"
+DEEPGRAM_PARAMS = {
+    "model": "nova-2",
+    "language": "en-US",
+    "smart_format": "true",
+}
+
+# Live transcription: audio is streamed while the user is still talking and
+# Deepgram decides when the utterance has ended
+DEEPGRAM_LISTEN_URL = "wss://api.deepgram.com/v1/listen"
+DEEPGRAM_STREAM_PARAMS = {
+    **DEEPGRAM_PARAMS,
+    "encoding": "linear16",
+    "interim_results": "true",
+    "endpointing": 300,  # ms of silence that ends an utterance (speech_final)
+    "utterance_end_ms": 1000,  # Word-gap fallback for noise that never goes silent
+    "no_delay": "true",
+}
+AUDIO_QUEUE_FRAMES = 50  # About 1 s of 20 ms frames buffered ahead of the socket
+DEEPGRAM_KEEPALIVE_INTERVAL = 5  # Seconds between KeepAlive messages on an idle stream
+DEEPGRAM_FINALIZE_TIMEOUT = 2  # Seconds to wait for the reply to Finalize before giving up on a stream
+
+# Control messages are serialized once; Deepgram expects them as text frames
+DEEPGRAM_KEEPALIVE = orjson.dumps({"type": "KeepAlive"}).decode()
+DEEPGRAM_FINALIZE = orjson.dumps({"type": "Finalize"}).decode()
+DEEPGRAM_CLOSE_STREAM = orjson.dumps({"type": "CloseStream"}).decode()
+
+# One long-lived keep-alive (HTTP/2) connection pool shared by the Deepgram,
+# Groq and ElevenLabs calls; the blocking one serves Flask, the async one the agent
+HTTP_TIMEOUT = httpx.Timeout(30.0, connect=5.0)
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=32, keepalive_expiry=60)
+http_client = httpx.Client(http2=True, timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS)
+async_http_client = httpx.AsyncClient(http2=True, timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS)
+
+groq_client = groq.Client(api_key=GROQ_API_KEY, http_client=http_client)
+elevenlabs_client = ElevenLabs(api_key=ELEVENLABS_API_KEY, httpx_client=http_client)
+groq_async_client = groq.AsyncClient(api_key=GROQ_API_KEY, http_client=async_http_client)
+elevenlabs_async_client = AsyncElevenLabs(api_key=ELEVENLABS_API_KEY, httpx_client=async_http_client)
+
+# Replies to repeated (or, with fastembed installed, near-identical) utterances,
+# shared by the Flask routes and the agent; they expire after LLM_CACHE_TTL seconds
+llm_cache = SemanticResponseCache(
+    threshold=float(os.getenv("LLM_CACHE_THRESHOLD", "0.92")),
+    ttl=float(os.getenv("LLM_CACHE_TTL", "3600")),
+)
+
+# Synthesized audio for repeated replies (greetings, confirmations, errors);
+# set TTS_CACHE_DIR to keep it on disk across restarts
+tts_cache = AudioCache(directory=os.getenv("TTS_CACHE_DIR"))
+
+# Fixed phrases the agent speaks on its fallback paths; prewarm_tts_cache()
+# synthesizes them ahead of time so they never wait on ElevenLabs
+NOT_HEARD_PHRASE = "I didn't catch that. Could you say it again?"
+NOT_UNDERSTOOD_PHRASE = "Sorry, I had trouble understanding that."
+ERROR_PHRASE = "I'm sorry, there was an issue."
+CANNED_PHRASES = (NOT_HEARD_PHRASE, NOT_UNDERSTOOD_PHRASE, ERROR_PHRASE)
+
+# Duplicate uploads of the same audio (e.g. a client retrying on a slow
+# network) share one Deepgram call: concurrent duplicates wait on the
+# in-flight request, later ones within STT_DEDUP_TTL seconds reuse its result
+STT_DEDUP_TTL = 10.0
+recent_transcripts = RecentResults(ttl=STT_DEDUP_TTL)
+stt_inflight = {}  # audio digest -> concurrent.futures.Future
+stt_inflight_lock = threading.Lock()
+stt_inflight_async = {}  # audio digest -> asyncio.Task, only touched from the event loop
+
+# Bind the SDK entry points once: every attribute hop below builds a fresh
+# sub-client object, which would otherwise happen on each request
+elevenlabs_stream = elevenlabs_client.text_to_speech.convert_as_stream
+elevenlabs_stream_async = elevenlabs_async_client.text_to_speech.convert_as_stream
+
+def build_llm_messages(transcription):
+    """Chat messages asking the LLM to reply to the user's utterance"""
+    return [SYSTEM_PROMPT, {"role": "user", "content": PROMPT_TEMPLATE.format(transcription=transcription)}]
+
+def split_sentences(text):
+    """Split completed sentences off streamed text, returning (sentences, remainder)"""
+    parts = SENTENCE_BOUNDARY.split(text)
+    return [part for part in parts[:-1] if part.strip()], parts[-1]
+
+def iter_frames(audio, frame_bytes=PCM_FRAME_BYTES):
+    """Yield zero-copy memoryview slices of audio, one frame each (the last may be short)
+
+    Frames match LiveKit's 20 ms packets, so they are sent without re-splitting.
+    """
+    view = memoryview(audio)
+    for start in range(0, len(view), frame_bytes):
+        yield view[start:start + frame_bytes]
+
+def deepgram_listen(content, content_type, **params):
+    """Send recorded audio to Deepgram's REST endpoint, returning the transcript"""
+    response = http_client.post(
+        DEEPGRAM_API_URL,
+        params={**DEEPGRAM_PARAMS, **params},
+        headers={"Authorization": f"Token {DEEPGRAM_API_KEY}", "Content-Type": content_type},
+        content=content,
+    )
+    response.raise_for_status()
+    return orjson.loads(response.content)["results"]["channels"][0]["alternatives"][0]["transcript"]
+
+def transcribe_audio(audio_data, mime_type="audio/wav"):
+    """Transcribe recorded audio with Deepgram, sharing the result with duplicate uploads"""
+    if not DEEPGRAM_AVAILABLE:
+        raise RuntimeError("Deepgram API key not set")
+
+    key = audio_digest(audio_data)
+    with stt_inflight_lock:
+        transcript = recent_transcripts.get(key)
+        if transcript is not None:
+            return transcript
+        future = stt_inflight.get(key)
+        if future is not None:
+            owner = False
+        else:
+            owner = True
+            future = stt_inflight[key] = Future()
+    if not owner:
+        return future.result()
+
+    try:
+        transcript = deepgram_listen(audio_data, mime_type)
+        recent_transcripts.put(key, transcript)
+        future.set_result(transcript)
+        return transcript
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with stt_inflight_lock:
+            del stt_inflight[key]
+
+def create_llm_completion(transcription, stream=False):
+    """Ask Groq for a reply to the user's utterance, returning the raw (or streamed) completion"""
+    return groq_client.chat.completions.create(
+        messages=build_llm_messages(transcription),
+        stream=stream,
+        **LLM_OPTIONS,
+    )
+
+def cache_speech_stream(key, chunks):
+    """Pass audio chunks through, caching the complete audio once the stream finishes"""
+    parts = []
+    for chunk in chunks:
+        parts.append(chunk)
+        yield chunk
+    tts_cache.put(key, b"".join(parts))
+
+def open_speech_stream(text, voice_id=ELEVENLABS_VOICE_ID):
+    """Start streaming synthesis with ElevenLabs, returning (chunks, first_chunk_ns, cache_hit)
+
+    Audio synthesized before is replayed from the TTS cache. Otherwise the
+    first chunk is fetched before returning, so API errors surface here
+    instead of halfway through an HTTP response.
+    """
+    start = time.perf_counter_ns()
+    key = audio_cache_key(voice_id, ELEVENLABS_MODEL_ID, ELEVENLABS_OUTPUT_FORMAT, text)
+    audio = tts_cache.get(key)
+    if audio is not None:
+        return iter((audio,)), time.perf_counter_ns() - start, True
+
+    stream = iter(elevenlabs_stream(
+        voice_id=voice_id,
+        text=text,
+        model_id=ELEVENLABS_MODEL_ID,
+        output_format=ELEVENLABS_OUTPUT_FORMAT,
+    ))
+    first_chunk = next(stream, b"")
+    chunks = cache_speech_stream(key, itertools.chain((first_chunk,), stream))
+    return chunks, time.perf_counter_ns() - start, False
+
+# The coroutines below use the SDKs' native async clients, so the agent's event
+# loop never waits on a thread pool hop. Response cache lookups embed the
+# utterance (CPU-bound with fastembed), so those run in a worker thread instead
+# of stalling audio ingest.
+
+async def deepgram_listen_async(content, content_type, **params):
+    """Send recorded audio to Deepgram's REST endpoint, returning the transcript"""
+    response = await async_http_client.post(
+        DEEPGRAM_API_URL,
+        params={**DEEPGRAM_PARAMS, **params},
+        headers={"Authorization": f"Token {DEEPGRAM_API_KEY}", "Content-Type": content_type},
+        content=content,
+    )
+    response.raise_for_status()
+    return orjson.loads(response.content)["results"]["channels"][0]["alternatives"][0]["transcript"]
+
+async def transcribe_audio_data(audio_data, mime_type="audio/wav"):
+    """Transcribe recorded audio with Deepgram, sharing the result with duplicate uploads"""
+    key = audio_digest(audio_data)
+    transcript = recent_transcripts.get(key)
+    if transcript is not None:
+        return transcript
+
+    async def fetch():
+        try:
+            transcript = await deepgram_listen_async(audio_data, mime_type)
+            recent_transcripts.put(key, transcript)
+            return transcript
+        finally:
+            del stt_inflight_async[key]
+
+    request = stt_inflight_async.get(key)
+    if request is None:
+        request = stt_inflight_async[key] = asyncio.create_task(fetch())
+    # Shielded so a cancelled caller, even the one that started the request,
+    # doesn't cancel it for the duplicates sharing it
+    return await asyncio.shield(request)
+
+async def transcribe_pcm(chunks, sample_rate, channels=1, encoding="linear16"):
+    """Transcribe recorded raw PCM with Deepgram
+
+    The chunks (e.g. the frames of one utterance) are uploaded as a streamed
+    request body, so the audio is never joined into one contiguous buffer.
+    """
+    async def body():
+        for chunk in chunks:
+            yield bytes(chunk)
+
+    return await deepgram_listen_async(
+        body(), "application/octet-stream",
+        encoding=encoding, sample_rate=sample_rate, channels=channels,
+    )
+
+class LiveTranscriber:
+    """A Deepgram streaming connection reused for every turn of one session
+
+    The socket is opened on the first turn and kept alive in between, so later
+    turns skip the TLS and WebSocket handshakes. A turn that ends on Deepgram's
+    endpoint is flushed with Finalize before the next one starts, so its late
+    results never leak into it. Call close() when the session (e.g. the
+    LiveKit room) ends.
+
+    Audio is sent exactly as captured in the given encoding; a telephony-grade
+    track (encoding="mulaw", sample_rate=8000) uploads about a quarter of the
+    bytes of 16 kHz linear16 without transcoding on the agent.
+    """
+
+    def __init__(self, sample_rate, channels=1, encoding="linear16"):
+        query = urlencode({
+            **DEEPGRAM_STREAM_PARAMS,
+            "encoding": encoding,
+            "sample_rate": sample_rate,
+            "channels": channels,
+        })
+        self.url = f"{DEEPGRAM_LISTEN_URL}?{query}"
+        self._ws = None
+        self._keepalive = None
+        self._draining = None
+
+    async def _connect(self):
+        if self._draining is not None:
+            draining, self._draining = self._draining, None
+            try:
+                await draining
+            except Exception:
+                # The last turn's results may still arrive; start over
+                await self.close()
+        if self._ws is None or self._ws.state is not State.OPEN:
+            headers = {"Authorization": f"Token {DEEPGRAM_API_KEY}"}
+            self._ws = await websocket_connect(self.url, additional_headers=headers)
+            self._keepalive = asyncio.create_task(self._keep_alive(self._ws))
+        return self._ws
+
+    async def _keep_alive(self, ws):
+        # Deepgram closes a stream that receives nothing for about 10 s
+        try:
+            while True:
+                await asyncio.sleep(DEEPGRAM_KEEPALIVE_INTERVAL)
+                await ws.send(DEEPGRAM_KEEPALIVE)
+        except ConnectionClosed:
+            pass
+
+    async def _drain(self, ws, send_finalize):
+        # Discard what is left of a turn that ended on Deepgram's endpoint:
+        # results for audio already sent, up to the reply to Finalize
+        if send_finalize:
+            await ws.send(DEEPGRAM_FINALIZE)
+        async for message in ws:
+            result = orjson.loads(message)
+            if result.get("type") == "Results" and result.get("from_finalize"):
+                return
+
+    async def close(self):
+        """Close the connection; a later turn opens a new one"""
+        if self._draining is not None:
+            self._draining.cancel()
+            self._draining = None
+        if self._ws is None:
+            return
+        self._keepalive.cancel()
+        ws, self._ws = self._ws, None
+        try:
+            await ws.send(DEEPGRAM_CLOSE_STREAM)
+        except ConnectionClosed:
+            pass
+        await ws.close()
+
+    async def transcribe(self, frames):
+        """Transcribe one utterance of live audio
+
+        Frames from the async iterable are forwarded as they arrive, so
+        recognition overlaps capture, and the transcript is returned as soon as
+        Deepgram marks the end of speech (after a silence, or a gap in
+        recognized words for noisy input) or the audio runs out. Frames are
+        drained into a bounded queue so a slow socket never stalls capture; if
+        the queue fills up, new frames are dropped rather than delivered late.
+        """
+        ws = await self._connect()
+        queue = asyncio.Queue(maxsize=AUDIO_QUEUE_FRAMES)
+        segments = []
+        finalize_sent = False
+        finalized = False
+
+        async def capture_audio():
+            cancelled = False
+            backlogged = False
+            try:
+                async for frame in frames:
+                    try:
+                        queue.put_nowait(frame)
+                        backlogged = False
+                    except asyncio.QueueFull:
+                        if not backlogged:
+                            logger.warning("Deepgram stream is falling behind, dropping audio frames")
+                        backlogged = True
+            except asyncio.CancelledError:
+                cancelled = True
+                raise
+            finally:
+                # Once cancelled, nothing drains the queue, so it may never have room
+                if not cancelled:
+                    await queue.put(None)
+
+        async def send_audio():
+            nonlocal finalize_sent
+            capture = asyncio.create_task(capture_audio())
+            try:
+                while (frame := await queue.get()) is not None:
+                    await ws.send(bytes(frame))
+                await capture  # Raises if reading the audio failed
+            finally:
+                capture.cancel()
+            # Deepgram flushes the remaining audio; the socket stays open
+            await ws.send(DEEPGRAM_FINALIZE)
+            finalize_sent = True
+
+        async def receive_transcript():
+            nonlocal finalized
+            async for message in ws:
+                result = orjson.loads(message)
+                if result.get("type") == "UtteranceEnd" and segments:
+                    break
+                if result.get("type") != "Results" or not result.get("is_final"):
+                    continue
+                transcript = result["channel"]["alternatives"][0]["transcript"]
+                if transcript:
+                    segments.append(transcript)
+                finalized = finalized or result.get("from_finalize", False)
+                if result.get("speech_final") or finalized:
+                    break
+            return " ".join(segments)
+
+        sender = asyncio.create_task(send_audio())
+        receiver = asyncio.create_task(receive_transcript())
+        reusable = False
+        try:
+            await asyncio.wait((sender, receiver), return_when=asyncio.FIRST_COMPLETED)
+            if not receiver.done():
+                sender.result()  # Raises if reading or sending the audio failed
+                await asyncio.wait((receiver,), timeout=DEEPGRAM_FINALIZE_TIMEOUT)
+                if not receiver.done():
+                    # The stream can't be trusted for another turn; keep what arrived
+                    logger.warning("Deepgram did not answer Finalize, closing the stream")
+                    return " ".join(segments)
+            transcript = receiver.result()
+            reusable = True
+            return transcript
+        finally:
+            sender.cancel()
+            receiver.cancel()
+            if not reusable:
+                await self.close()
+            elif not finalized:
+                # Late results would leak into the next turn, which waits for
+                # them to be drained before reusing the socket
+                await asyncio.wait((sender,))
+                self._draining = asyncio.create_task(asyncio.wait_for(
+                    self._drain(ws, send_finalize=not finalize_sent),
+                    DEEPGRAM_FINALIZE_TIMEOUT,
+                ))
+
+async def transcribe_stream(frames, sample_rate, channels=1, encoding="linear16"):
+    """Transcribe one utterance of live audio over a one-off Deepgram connection"""
+    transcriber = LiveTranscriber(sample_rate, channels, encoding)
+    try:
+        return await transcriber.transcribe(frames)
+    finally:
+        await transcriber.close()
+
+async def cache_lookup(transcription):
+    """Look up a cached reply, off the event loop only if that means embedding the utterance"""
+    if llm_cache.semantic:
+        return await asyncio.to_thread(llm_cache.get, transcription)
+    return llm_cache.get(transcription)
+
+async def cache_store(transcription, response_text):
+    """Cache a reply, off the event loop only if that means embedding the utterance"""
+    if llm_cache.semantic:
+        await asyncio.to_thread(llm_cache.put, transcription, response_text)
+    else:
+        llm_cache.put(transcription, response_text)
+
+async def get_llm_response(transcription):
+    """Generate a reply to the user's utterance with Groq, or replay a cached one"""
+    response_text = await cache_lookup(transcription)
+    if response_text is None:
+        response = await groq_async_client.chat.completions.create(
+            messages=build_llm_messages(transcription),
+            **LLM_OPTIONS,
+        )
+        response_text = response.choices[0].message.content
+        await cache_store(transcription, response_text)
+    return response_text
+
+async def stream_llm_response(transcription):
+    """Stream the reply to the user's utterance from Groq, yielding text deltas
+
+    A cached reply is yielded whole; a streamed one is cached once complete.
+    """
+    response_text = await cache_lookup(transcription)
+    if response_text is not None:
+        yield response_text
+        return
+
+    stream = await groq_async_client.chat.completions.create(
+        messages=build_llm_messages(transcription),
+        stream=True,
+        **LLM_OPTIONS,
+    )
+    parts = []
+    async for chunk in stream:
+        token = chunk.choices[0].delta.content if chunk.choices else None
+        if token:
+            parts.append(token)
+            yield token
+    await cache_store(transcription, "".join(parts))
+
+async def synthesize_speech(text, voice_id=ELEVENLABS_VOICE_ID):
+    """Synthesize text with ElevenLabs, returning the MP3 bytes"""
+    key = audio_cache_key(voice_id, ELEVENLABS_MODEL_ID, ELEVENLABS_OUTPUT_FORMAT, text)
+    audio = tts_cache.get(key)
+    if audio is None:
+        chunks = elevenlabs_stream_async(
+            voice_id=voice_id,
+            text=text,
+            model_id=ELEVENLABS_MODEL_ID,
+            output_format=ELEVENLABS_OUTPUT_FORMAT,
+        )
+        audio = b"".join([chunk async for chunk in chunks])
+        tts_cache.put(key, audio)
+    return audio
+
+async def synthesize_speech_stream(text, voice_id=ELEVENLABS_VOICE_ID):
+    """Stream synthesized speech from ElevenLabs as 16 kHz PCM16
+
+    Audio is yielded as soon as it arrives, one 20 ms frame per chunk, so
+    playback starts after the first chunk rather than after the whole
+    synthesis. Audio synthesized before is replayed from the TTS cache.
+    """
+    key = audio_cache_key(voice_id, ELEVENLABS_MODEL_ID, ELEVENLABS_PCM_FORMAT, text)
+    audio = tts_cache.get(key)
+    if audio is not None:
+        for frame in iter_frames(audio):
+            yield frame
+        return
+
+    chunks = elevenlabs_stream_async(
+        voice_id=voice_id,
+        text=text,
+        model_id=ELEVENLABS_MODEL_ID,
+        output_format=ELEVENLABS_PCM_FORMAT,
+    )
+    parts = []
+    pending = b""
+    async for chunk in chunks:
+        parts.append(chunk)
+        pending += chunk
+        aligned = len(pending) - len(pending) % PCM_FRAME_BYTES
+        for frame in iter_frames(memoryview(pending)[:aligned]):
+            yield frame
+        pending = pending[aligned:]
+    if pending:
+        yield pending
+    tts_cache.put(key, b"".join(parts))
+
+async def prewarm_tts_cache(phrases=CANNED_PHRASES, voice_id=ELEVENLABS_VOICE_ID):
+    """Synthesize phrases into the TTS cache ahead of time; ones already cached are skipped"""
+    async def warm(text):
+        async for _ in synthesize_speech_stream(text, voice_id):
+            pass
+
+    results = await asyncio.gather(*(warm(text) for text in phrases), return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error(f"Error in prewarm_tts_cache: {str(result)}")
+
+async def respond_to_speech(frames, sample_rate, channels=1, encoding="linear16", transcriber=None):
+    """Run one conversation turn on live audio, yielding the spoken reply as PCM
+
+    Transcription, generation and synthesis run as pipelined tasks: the LLM
+    starts as soon as Deepgram marks the end of speech, and each sentence of
+    its reply starts synthesizing the moment it is complete, concurrently with
+    the sentences before it (at most TTS_CONCURRENCY at a time). Audio is
+    yielded in sentence order, so the reply starts playing while the rest is
+    still being generated and synthesized.
+
+    Failures are answered with a canned phrase chosen by where they happen: no
+    speech gets NOT_HEARD_PHRASE, a failed transcription NOT_UNDERSTOOD_PHRASE,
+    and any later failure ERROR_PHRASE.
+
+    Pass the session's LiveTranscriber to reuse its Deepgram connection;
+    otherwise a one-off connection is opened for this turn.
+    """
+    speech = asyncio.Queue()  # (synthesis task, its audio queue) per sentence, in order
+    synthesis_slots = asyncio.Semaphore(TTS_CONCURRENCY)
+    tasks = []
+
+    def speak(sentence):
+        chunks = asyncio.Queue()
+
+        async def synthesize():
+            try:
+                async with synthesis_slots:
+                    async for chunk in synthesize_speech_stream(sentence):
+                        chunks.put_nowait(chunk)
+            finally:
+                chunks.put_nowait(None)
+
+        task = asyncio.create_task(synthesize())
+        tasks.append(task)
+        speech.put_nowait((task, chunks))
+
+    async def generate_reply():
+        try:
+            try:
+                if transcriber is not None:
+                    transcription = await transcriber.transcribe(frames)
+                else:
+                    transcription = await transcribe_stream(frames, sample_rate, channels, encoding)
+            except Exception as e:
+                logger.error(f"Error in respond_to_speech transcription: {str(e)}")
+                speak(NOT_UNDERSTOOD_PHRASE)
+                return
+            if not transcription:
+                speak(NOT_HEARD_PHRASE)
+                return
+            buffer = ""
+            async for token in stream_llm_response(transcription):
+                complete, buffer = split_sentences(buffer + token)
+                for sentence in complete:
+                    speak(sentence)
+            if buffer.strip():
+                speak(buffer)
+        finally:
+            speech.put_nowait(None)
+
+    generator = asyncio.create_task(generate_reply())
+    tasks.append(generator)
+    try:
+        while (entry := await speech.get()) is not None:
+            task, chunks = entry
+            while (chunk := await chunks.get()) is not None:
+                yield chunk
+            await task  # Surface a synthesis error
+        await generator  # Surface an LLM error
+    except Exception as e:
+        logger.error(f"Error in respond_to_speech: {str(e)}")
+        # Served from the TTS cache once prewarm_tts_cache() has run
+        async for chunk in synthesize_speech_stream(ERROR_PHRASE):
+            yield chunk
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def close_async_clients():
+    """Close the agent's shared HTTP connections; await this when the agent shuts down"""
+    await async_http_client.aclose()
@@ -1,168 +1,293 @@
 import os
+import re
+import glob
 import time
-import json
 import base64
+import uuid
+import queue
 import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from urllib.parse import quote
+import orjson
 import pandas as pd
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
+from flask_compress import Compress
 from dotenv import load_dotenv
 import requests
 
-# Import the correct Deepgram SDK 
-try:
-    # First try modern API style
-    from deepgram import DeepgramClient
-    from deepgram import PrerecordedOptions
-    MODERN_DEEPGRAM = True
-    DEEPGRAM_AVAILABLE = True
-    print("Using modern Deepgram SDK")
-except ImportError as e:
-    print(f"Modern Deepgram import error: {e}")
-    MODERN_DEEPGRAM = False
-    try:
-        # Fall back to legacy API style
-        from deepgram import Deepgram
-        DEEPGRAM_AVAILABLE = True
-        print("Using legacy Deepgram SDK")
-    except ImportError as e:
-        print(f"Legacy Deepgram import error: {e}")
-        DEEPGRAM_AVAILABLE = False
-
-try:
-    import groq
-except ImportError:
-    # Fallback to openai-style client if groq not installed
-    import openai as groq
-    
-# Import ElevenLabs with updated API structure - using newest 2.3.0 version
-from elevenlabs.client import ElevenLabs
-from elevenlabs import Voice, VoiceSettings
+from agent_helpers import (
+    DEEPGRAM_AVAILABLE,
+    ELEVENLABS_VOICE_ID,
+    create_llm_completion,
+    llm_cache,
+    open_speech_stream,
+    split_sentences,
+    transcribe_audio,
+)
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging; gunicorn.conf.py defaults LOG_LEVEL to WARNING in production
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
 # Load environment variables from .env file
 load_dotenv()
 
+class OrjsonProvider(JSONProvider):
+    """Serialize responses and parse request bodies with orjson instead of the stdlib"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 # Initialize Flask app
 app = Flask(__name__)
-CORS(app)
+app.json = OrjsonProvider(app)
+CORS(app, expose_headers=["X-Metrics", "X-Transcription"])
+
+# Compress JSON/text responses (the full /metrics log can reach megabytes);
+# audio streams are already compressed and are left alone
+app.config['COMPRESS_MIMETYPES'] = ['application/json', 'text/plain']
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+Compress(app)
 
 # Print environment variables for debugging
 logger.info(f"DEEPGRAM_API_KEY: {'Set' if os.getenv('DEEPGRAM_API_KEY') else 'Not set'}")
 logger.info(f"ELEVENLABS_API_KEY: {'Set' if os.getenv('ELEVENLABS_API_KEY') else 'Not set'}")
 logger.info(f"GROQ_API_KEY: {'Set' if os.getenv('GROQ_API_KEY') else 'Not set'}")
 
-# Initialize API keys and clients
-DEEPGRAM_API_KEY = os.getenv("DEEPGRAM_API_KEY")
-ELEVENLABS_API_KEY = os.getenv("ELEVENLABS_API_KEY")
-ELEVENLABS_VOICE_ID = os.getenv("ELEVENLABS_VOICE_ID", "21m00Tcm4TlvDq8ikWAM")  # Default to Rachel
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+# MIME type in the header of a "data:audio/webm;base64,..." upload
+DATA_URI_MIME = re.compile(r'data:([^;,]+)')
+
+# Sentence synthesis for every conversation turn shares one bounded, named pool
+tts_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="tts")
+
+# Metrics storage: handlers only enqueue entries; a background thread appends
+# them to a JSON-lines log for the session and keeps the most recent entries
+# in memory for /metrics. Under gunicorn every worker writes its own log for
+# the session; exports combine them
+METRICS_SESSION = os.getenv("METRICS_SESSION", datetime.now().strftime('%Y%m%d_%H%M%S'))
+if os.getenv("METRICS_LOG_PATH"):
+    METRICS_LOG_PATH = os.getenv("METRICS_LOG_PATH")
+    METRICS_LOG_GLOB = glob.escape(METRICS_LOG_PATH)
+else:
+    METRICS_LOG_PATH = f"metrics_{METRICS_SESSION}_{os.getpid()}.jsonl"
+    METRICS_LOG_GLOB = f"metrics_{METRICS_SESSION}_*.jsonl"
+METRICS_LOG_MAXLEN = 50000
+metrics_log = deque(maxlen=METRICS_LOG_MAXLEN)
+metrics_queue = queue.SimpleQueue()
+
+def record_metric(entry):
+    """Queue a metric entry for the background metrics writer"""
+    metrics_queue.put(entry)
+
+def write_metrics():
+    """Drain the metrics queue into memory and the session's metrics file"""
+    try:
+        metrics_file = open(METRICS_LOG_PATH, 'ab')
+    except OSError as e:
+        # Keep serving /metrics from memory rather than letting the queue grow
+        logger.error(f"Error opening metrics log, metrics are kept in memory only: {str(e)}")
+        metrics_file = None
+    while True:
+        entry = metrics_queue.get()
+        metrics_log.append(entry)
+        if metrics_file is None:
+            continue
+        try:
+            metrics_file.write(orjson.dumps(entry) + b"\n")
+            if metrics_queue.empty():
+                metrics_file.flush()
+        except Exception as e:
+            logger.error(f"Error writing metric entry: {str(e)}")
+
+threading.Thread(target=write_metrics, name="metrics-writer", daemon=True).start()
+
+# Excel exports run one at a time off the request thread; clients poll by job
+# id. Job state lives in files named after the job, so any gunicorn worker can
+# answer a poll and nothing accumulates in memory
+export_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="export")
+EXPORT_JOB_ID = re.compile(r'[0-9a-f]{32}')
+
+def export_paths(job_id):
+    """Paths of an export job's spreadsheet, failure marker and pending marker"""
+    base = f"metrics_export_{job_id}"
+    return f"{base}.xlsx", f"{base}.err", f"{base}.pending"
+
+def save_metrics_to_excel(filename):
+    """Convert the session's metrics logs to an Excel file, returning False if there are no metrics"""
+    paths = [path for path in sorted(glob.glob(METRICS_LOG_GLOB)) if os.path.getsize(path) > 0]
+    if not paths:
+        return False
+    df = pd.concat(pd.read_json(path, lines=True, convert_dates=False) for path in paths)
+    df = df.sort_values("timestamp", kind="stable")
+    # constant_memory makes xlsxwriter flush each row as it's written; the
+    # spreadsheet only appears under its final name once it is complete
+    partial = filename.replace(".xlsx", ".part.xlsx")
+    df.to_excel(
+        partial,
+        index=False,
+        engine='xlsxwriter',
+        engine_kwargs={'options': {'constant_memory': True}},
+    )
+    os.replace(partial, filename)
+    return True
 
-# Initialize clients
-if DEEPGRAM_AVAILABLE:
+def run_export(job_id):
+    """Write an export job's spreadsheet, or a failure marker for the status route"""
+    filename, error_path, pending_path = export_paths(job_id)
+    error = None
     try:
-        deepgram = DeepgramClient(DEEPGRAM_API_KEY)
-        logger.info("Deepgram client initialized successfully")
+        if not save_metrics_to_excel(filename):
+            error = {"message": "No metrics to export", "code": 200}
     except Exception as e:
-        logger.error(f"Failed to initialize Deepgram client: {e}")
-        DEEPGRAM_AVAILABLE = False
+        logger.error(f"Error in export_metrics: {str(e)}")
+        error = {"message": str(e), "code": 500}
+    
+    # Write the result before dropping the pending marker, so a poll never
+    # finds a job with neither
+    if error is not None:
+        with open(error_path, 'wb') as f:
+            f.write(orjson.dumps(error))
+    os.remove(pending_path)
+
+def read_audio_payload():
+    """Read the uploaded audio from the request, returning (audio_binary, mime_type)
+
+    Raw uploads (an audio/* or application/octet-stream body) are used as-is,
+    skipping JSON and base64 entirely. JSON bodies carrying a base64 data URI
+    in `audioDataUri` are still accepted.
+    """
+    if request.mimetype.startswith('audio/') or request.mimetype == 'application/octet-stream':
+        mime_type = request.mimetype if request.mimetype.startswith('audio/') else "audio/wav"
+        return request.get_data(cache=False), mime_type
+    
+    data = request.get_json(silent=True)
+    if not data or 'audioDataUri' not in data:
+        return None, None
+    
+    # Locate the base64 payload without splitting (and copying) the whole URI
+    audio_data_uri = data['audioDataUri']
+    comma = audio_data_uri.find(',')
+    if comma < 0:
+        return None, None
+    
+    # Determine content type from the header
+    match = DATA_URI_MIME.match(audio_data_uri, 0, comma)
+    mime_type = match.group(1) if match else "audio/wav"
+    
+    # Convert base64 to binary, decoding straight from a view of the URI
+    audio_binary = base64.b64decode(memoryview(audio_data_uri.encode('ascii'))[comma + 1:])
+    return audio_binary, mime_type
+
+def cached_prompt_tokens(usage):
+    """Number of prompt tokens Groq served from its prompt cache, if reported"""
+    details = getattr(usage, 'prompt_tokens_details', None)
+    return getattr(details, 'cached_tokens', None)
 
-groq_client = groq.Client(api_key=GROQ_API_KEY)
-elevenlabs_client = ElevenLabs(api_key=ELEVENLABS_API_KEY)
+def iter_completion_tokens(groq_stream, usage):
+    """Yield the text deltas of a streamed Groq completion, recording token usage into `usage`"""
+    for chunk in groq_stream:
+        chunk_usage = getattr(getattr(chunk, 'x_groq', None), 'usage', None)
+        if chunk_usage is not None:
+            usage["completion_tokens"] = chunk_usage.completion_tokens
+            usage["cached_tokens"] = cached_prompt_tokens(chunk_usage)
+        
+        token = chunk.choices[0].delta.content if chunk.choices else None
+        if token:
+            yield token
 
-# Metrics storage
-metrics_log = []
+NS_PER_MS = 1_000_000
 
-def save_metrics_to_excel():
-    """Save metrics to Excel file"""
-    if metrics_log:
-        df = pd.DataFrame(metrics_log)
-        filename = f"metrics_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        df.to_excel(filename, index=False)
-        return filename
-    return None
+class Stopwatch:
+    """Context manager recording the nanoseconds spent inside its block"""
+    
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        self.elapsed = 0
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.elapsed = time.perf_counter_ns() - self.start
+
+def stage_metrics(stage, total_latency, service_latency, timestamp=None, **extra):
+    """Build the metric entry for one pipeline stage from latencies in nanoseconds"""
+    return {
+        "timestamp": timestamp or datetime.now().isoformat(),
+        "type": stage,
+        "total_latency": total_latency // NS_PER_MS,  # ms
+        "service_latency": service_latency // NS_PER_MS,  # ms
+        "processing_overhead": max(total_latency - service_latency, 0) // NS_PER_MS,  # ms
+        **extra,
+    }
+
+def run_stt(timestamp=None):
+    """Transcribe the uploaded audio, returning (transcription, metric_entry)
+
+    Returns (None, None) if the request carries no audio.
+    """
+    with Stopwatch() as total:
+        audio_binary, mime_type = read_audio_payload()
+        if not audio_binary:
+            return None, None
+        
+        # Process with Deepgram
+        with Stopwatch() as deepgram_call:
+            transcription = transcribe_audio(audio_binary, mime_type)
+    
+    metric_entry = stage_metrics("stt", total.elapsed, deepgram_call.elapsed, timestamp)
+    record_metric(metric_entry)
+    return transcription, metric_entry
 
 @app.route('/metrics', methods=['GET'])
 def get_metrics():
     """Get all metrics logged during the session"""
-    return jsonify(metrics_log)
+    return jsonify(list(metrics_log))
 
 @app.route('/metrics/export', methods=['GET'])
 def export_metrics():
-    """Export metrics to Excel file"""
-    filename = save_metrics_to_excel()
-    if filename:
+    """Start exporting metrics to an Excel file in the background"""
+    job_id = uuid.uuid4().hex
+    _, _, pending_path = export_paths(job_id)
+    open(pending_path, 'wb').close()
+    export_pool.submit(run_export, job_id)
+    return jsonify({"status": "pending", "job_id": job_id}), 202
+
+@app.route('/metrics/export/<job_id>', methods=['GET'])
+def export_metrics_status(job_id):
+    """Poll a metrics export started with /metrics/export"""
+    if not EXPORT_JOB_ID.fullmatch(job_id):
+        return jsonify({"status": "error", "message": "Unknown export job"}), 404
+    
+    # Check the pending marker first: a job writes its result before removing it
+    filename, error_path, pending_path = export_paths(job_id)
+    if os.path.exists(pending_path):
+        return jsonify({"status": "pending", "job_id": job_id}), 202
+    if os.path.exists(filename):
         return jsonify({"status": "success", "filename": filename})
-    return jsonify({"status": "error", "message": "No metrics to export"})
+    if os.path.exists(error_path):
+        with open(error_path, 'rb') as f:
+            error = orjson.loads(f.read())
+        return jsonify({"status": "error", "message": error["message"]}), error["code"]
+    return jsonify({"status": "error", "message": "Unknown export job"}), 404
 
 @app.route('/api/stt', methods=['POST'])
 def speech_to_text():
     """Convert audio to text using Deepgram"""
-    start_time = time.time()
-    
     if not DEEPGRAM_AVAILABLE:
-        return jsonify({"error": "Deepgram SDK not available"}), 500
+        return jsonify({"error": "Deepgram API key not set"}), 500
     
     try:
-        data = request.json
-        if not data or 'audioDataUri' not in data:
+        transcript, metric_entry = run_stt()
+        if metric_entry is None:
             return jsonify({"error": "No audio data provided"}), 400
         
-        # Extract the base64 audio data from the data URI
-        audio_data_uri = data['audioDataUri']
-        header, base64_data = audio_data_uri.split(',')
-        
-        # Convert base64 to binary
-        audio_binary = base64.b64decode(base64_data)
-        
-        # Determine content type from header
-        mime_type = header.split(':')[1].split(';')[0] if ':' in header else "audio/wav"
-        
-        # Process with Deepgram
-        deepgram_start = time.time()
-        
-        if MODERN_DEEPGRAM:
-            # Modern Deepgram SDK approach
-            options = PrerecordedOptions(
-                model="nova-2", 
-                smart_format=True,
-                language="en-US",
-            )
-            
-            # Create payload directly without FileSource
-            payload = {"buffer": audio_binary, "mimetype": mime_type}
-            
-            # Make the transcription request
-            response = deepgram.listen.prerecorded.transcribe_file(payload, options)
-            
-            # Extract transcript
-            transcript = response.results.channels[0].alternatives[0].transcript
-        else:
-            # Legacy approach
-            source = {"buffer": audio_binary, "mimetype": mime_type}
-            response = deepgram.transcription.sync_prerecorded(source, {"punctuate": True, "model": "nova"})
-            transcript = response["results"]["channels"][0]["alternatives"][0]["transcript"]
-        
-        deepgram_end = time.time()
-        
-        end_time = time.time()
-        stt_latency = end_time - start_time
-        deepgram_latency = deepgram_end - deepgram_start
-        
-        # Log metrics
-        metric_entry = {
-            "timestamp": datetime.now().isoformat(),
-            "type": "stt",
-            "total_latency": round(stt_latency * 1000, 2),  # ms
-            "service_latency": round(deepgram_latency * 1000, 2),  # ms
-            "processing_overhead": round((stt_latency - deepgram_latency) * 1000, 2),  # ms
-        }
-        metrics_log.append(metric_entry)
-        
         return jsonify({
             "transcription": transcript,
             "metrics": metric_entry
@@ -175,62 +300,37 @@ def speech_to_text():
 @app.route('/api/llm', methods=['POST'])
 def generate_response():
     """Generate response using Groq LLM"""
-    start_time = time.time()
-    
     try:
-        data = request.json
-        if not data or 'transcription' not in data:
-            return jsonify({"error": "No transcription provided"}), 400
-        
-        transcription = data['transcription']
-        
-        # Prepare the prompt
-        prompt = f"""You are a helpful voice assistant for a small business. 
-        The user said: '{transcription}'
-        
-        Respond naturally and concisely, keeping your response under 3 sentences when possible.
-        """
-        
-        # Call Groq API
-        llm_start = time.time()
-        groq_response = groq_client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a helpful voice assistant that provides concise, accurate responses."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            model="llama3-8b-8192",  # Use Llama 3 8B model for a good balance of quality and speed
-            max_tokens=300,
-            temperature=0.7,
-        )
-        llm_end = time.time()
-        
-        # Extract the generated text
-        response_text = groq_response.choices[0].message.content
-        
-        end_time = time.time()
-        llm_latency = end_time - start_time
-        groq_latency = llm_end - llm_start
+        with Stopwatch() as total:
+            data = request.json
+            if not data or 'transcription' not in data:
+                return jsonify({"error": "No transcription provided"}), 400
+            
+            transcription = data['transcription']
+            
+            # Serve repeated questions from the response cache, otherwise call Groq
+            with Stopwatch() as groq_call:
+                response_text = llm_cache.get(transcription)
+                cache_hit = response_text is not None
+                usage = None
+                if not cache_hit:
+                    groq_response = create_llm_completion(transcription)
+                    response_text = groq_response.choices[0].message.content
+                    usage = getattr(groq_response, 'usage', None)
+                    llm_cache.put(transcription, response_text)
         
         # Calculate TTFT (Time to First Token)
-        ttft = groq_response.usage.completion_tokens > 0 if hasattr(groq_response, 'usage') else True
+        ttft = usage.completion_tokens > 0 if usage is not None else True
         
         # Log metrics
-        metric_entry = {
-            "timestamp": datetime.now().isoformat(),
-            "type": "llm",
-            "total_latency": round(llm_latency * 1000, 2),  # ms
-            "service_latency": round(groq_latency * 1000, 2),  # ms
-            "processing_overhead": round((llm_latency - groq_latency) * 1000, 2),  # ms
-            "ttft": ttft,
-            "tokens": groq_response.usage.completion_tokens if hasattr(groq_response, 'usage') else None,
-        }
-        metrics_log.append(metric_entry)
+        metric_entry = stage_metrics(
+            "llm", total.elapsed, groq_call.elapsed,
+            ttft=ttft,
+            tokens=usage.completion_tokens if usage is not None else None,
+            cache_hit=cache_hit,
+            cached_tokens=cached_prompt_tokens(usage),
+        )
+        record_metric(metric_entry)
         
         return jsonify({
             "response": response_text,
@@ -244,49 +344,33 @@ def generate_response():
 @app.route('/api/tts', methods=['POST'])
 def text_to_speech():
     """Convert text to speech using ElevenLabs"""
-    start_time = time.time()
-    
     try:
-        data = request.json
-        if not data or 'text' not in data:
-            return jsonify({"error": "No text provided"}), 400
-        
-        text = data['text']
-        voice_id = data.get('voiceId', ELEVENLABS_VOICE_ID)
-        
-        # Call ElevenLabs API
-        tts_start = time.time()
-        response = elevenlabs_client.generate(
-            text=text,
-            voice=voice_id,
-            model_id="eleven_multilingual_v2",
-            output_format="mp3_22050_32"
-        )
-        audio = response  # Get the binary audio content
-        tts_end = time.time()
-        
-        # Convert audio to base64 for sending via JSON
-        audio_base64 = base64.b64encode(audio).decode('utf-8')
-        
-        end_time = time.time()
-        tts_latency = end_time - start_time
-        elevenlabs_latency = tts_end - tts_start
+        with Stopwatch() as total:
+            data = request.json
+            if not data or 'text' not in data:
+                return jsonify({"error": "No text provided"}), 400
+            
+            text = data['text']
+            voice_id = data.get('voiceId', ELEVENLABS_VOICE_ID)
+            
+            # Call ElevenLabs streaming API; latencies below are to the first audio chunk
+            audio_stream, elevenlabs_latency, tts_cache_hit = open_speech_stream(text, voice_id)
         
         # Log metrics
-        metric_entry = {
-            "timestamp": datetime.now().isoformat(),
-            "type": "tts",
-            "total_latency": round(tts_latency * 1000, 2),  # ms
-            "service_latency": round(elevenlabs_latency * 1000, 2),  # ms
-            "processing_overhead": round((tts_latency - elevenlabs_latency) * 1000, 2),  # ms
-            "text_length": len(text),
-        }
-        metrics_log.append(metric_entry)
-        
-        return jsonify({
-            "audio": audio_base64,
-            "metrics": metric_entry
-        })
+        metric_entry = stage_metrics(
+            "tts", total.elapsed, elevenlabs_latency,
+            text_length=len(text),
+            tts_cache_hit=tts_cache_hit,
+        )
+        record_metric(metric_entry)
+        
+        # Pipe the MP3 chunks straight through; metrics ride along in a header
+        return Response(
+            audio_stream,
+            mimetype='audio/mpeg',
+            headers={"X-Metrics": app.json.dumps(metric_entry)},
+            direct_passthrough=True,
+        )
     
     except Exception as e:
         logger.error(f"Error in text_to_speech: {str(e)}")
@@ -294,187 +378,180 @@ def text_to_speech():
 
 @app.route('/api/conversation', methods=['POST'])
 def process_conversation():
-    """Process a full conversation turn (STT → LLM → TTS)"""
-    start_time = time.time()
-    eou_start = time.time()  # EOU (End of Utterance) start time
+    """Process a full conversation turn (STT → LLM → TTS)
+
+    The LLM reply is streamed from Groq and every completed sentence is handed
+    to the shared TTS thread pool for synthesis, so audio for the first sentence is
+    streamed back while the rest of the reply is still being generated.
+    """
+    # One wall-clock timestamp for every metric of the turn; latencies use the
+    # monotonic nanosecond counter
+    start_time = time.perf_counter_ns()
+    timestamp = datetime.now().isoformat()
     
     if not DEEPGRAM_AVAILABLE:
-        return jsonify({"error": "Deepgram SDK not available"}), 500
+        return jsonify({"error": "Deepgram API key not set"}), 500
     
+    pending = deque()
     try:
-        data = request.json
-        if not data or 'audioDataUri' not in data:
-            return jsonify({"error": "No audio data provided"}), 400
-        
         # 1. Speech-to-Text
-        stt_start = time.time()
-        
-        # Extract audio data
-        audio_data_uri = data['audioDataUri']
-        header, base64_data = audio_data_uri.split(',')
-        audio_binary = base64.b64decode(base64_data)
-        
-        # Determine content type from header
-        mime_type = header.split(':')[1].split(';')[0] if ':' in header else "audio/wav"
+        transcription, stt_metrics = run_stt(timestamp)
+        if stt_metrics is None:
+            return jsonify({"error": "No audio data provided"}), 400
         
-        # Process with Deepgram
-        deepgram_start = time.time()
+        eou_time = time.perf_counter_ns() - start_time  # EOU (End of Utterance) delay
         
-        if MODERN_DEEPGRAM:
-            # Modern Deepgram SDK approach
-            options = PrerecordedOptions(
-                model="nova-2", 
-                smart_format=True,
-                language="en-US",
-            )
-            
-            # Create payload directly without FileSource
-            payload = {"buffer": audio_binary, "mimetype": mime_type}
-            
-            # Make the transcription request
-            response = deepgram.listen.prerecorded.transcribe_file(payload, options)
+        # 2. LLM Response Generation (streamed, or replayed from the response cache)
+        llm_start = time.perf_counter_ns()
+        llm_usage = {}
+        cached_response = llm_cache.get(transcription)
+        if cached_response is not None:
+            token_stream = iter((cached_response,))
+        else:
+            groq_stream = create_llm_completion(transcription, stream=True)
+            token_stream = iter_completion_tokens(groq_stream, llm_usage)
+        
+        # 3. Text-to-Speech: read the reply up to its first complete sentence
+        # and wait for that sentence's audio stream to open before responding,
+        # so a failure there is still reported as an error
+        response_parts = []
+        sentence_buffer = ""
+        ttft = None
+        tts_start = None
+        groq_end = None
+        for token in token_stream:
+            if ttft is None:
+                ttft = time.perf_counter_ns() - llm_start
+            response_parts.append(token)
             
-            # Extract transcript
-            transcription = response.results.channels[0].alternatives[0].transcript
+            sentences, sentence_buffer = split_sentences(sentence_buffer + token)
+            if sentences:
+                tts_start = time.perf_counter_ns()
+                pending.extend(tts_pool.submit(open_speech_stream, sentence) for sentence in sentences)
+                break
         else:
-            # Legacy approach
-            source = {"buffer": audio_binary, "mimetype": mime_type}
-            response = deepgram.transcription.sync_prerecorded(source, {"punctuate": True, "model": "nova"})
-            transcription = response["results"]["channels"][0]["alternatives"][0]["transcript"]
+            groq_end = time.perf_counter_ns()
+            if sentence_buffer.strip():
+                tts_start = time.perf_counter_ns()
+                pending.append(tts_pool.submit(open_speech_stream, sentence_buffer))
+            sentence_buffer = ""
+        if pending:
+            pending[0].result()  # Raises if the stream failed to open; stays queued for generate_audio
+    
+    except Exception as e:
+        logger.error(f"Error in process_conversation: {str(e)}")
+        for future in pending:
+            future.cancel()
+        return jsonify({"error": str(e)}), 500
+    
+    def generate_audio():
+        # The rest of the reply is synthesized one sentence at a time while the
+        # LLM is still decoding
+        nonlocal sentence_buffer, groq_end
+        elevenlabs_latency = None
+        tts_cache_hits = 0
+        ttfb = None
+        
+        def play(future):
+            nonlocal elevenlabs_latency, tts_cache_hits, ttfb
+            audio_stream, latency, cache_hit = future.result()
+            if elevenlabs_latency is None:
+                elevenlabs_latency = latency
+            tts_cache_hits += cache_hit
+            if ttfb is None:
+                ttfb = time.perf_counter_ns() - start_time
+            yield from audio_stream
+        
+        try:
+            # Send whatever audio is already synthesized, in order
+            while pending and pending[0].done():
+                yield from play(pending.popleft())
             
-        deepgram_end = time.time()
-        stt_end = time.time()
-        
-        # Calculate STT metrics
-        stt_latency = stt_end - stt_start
-        deepgram_latency = deepgram_end - deepgram_start
-        stt_metrics = {
-            "timestamp": datetime.now().isoformat(),
-            "type": "stt",
-            "total_latency": round(stt_latency * 1000, 2),  # ms
-            "service_latency": round(deepgram_latency * 1000, 2),  # ms
-            "processing_overhead": round((stt_latency - deepgram_latency) * 1000, 2),  # ms
-        }
-        metrics_log.append(stt_metrics)
-        
-        eou_time = time.time() - eou_start
-        
-        # 2. LLM Response Generation
-        llm_start = time.time()
-        
-        # Prepare the prompt
-        prompt = f"""You are a helpful voice assistant for a small business. 
-        The user said: '{transcription}'
-        
-        Respond naturally and concisely, keeping your response under 3 sentences when possible.
-        """
-        
-        # Call Groq API
-        groq_start = time.time()
-        groq_response = groq_client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a helpful voice assistant that provides concise, accurate responses."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            model="llama3-8b-8192",  # Use Llama 3 8B model for a good balance of quality and speed
-            max_tokens=300,
-            temperature=0.7,
-        )
-        groq_end = time.time()
-        
-        # Extract the generated text
-        response_text = groq_response.choices[0].message.content
-        llm_end = time.time()
+            if groq_end is None:
+                for token in token_stream:
+                    response_parts.append(token)
+                    
+                    sentences, sentence_buffer = split_sentences(sentence_buffer + token)
+                    for sentence in sentences:
+                        pending.append(tts_pool.submit(open_speech_stream, sentence))
+                    
+                    while pending and pending[0].done():
+                        yield from play(pending.popleft())
+                
+                groq_end = time.perf_counter_ns()
+                if sentence_buffer.strip():
+                    pending.append(tts_pool.submit(open_speech_stream, sentence_buffer))
+            
+            while pending:
+                yield from play(pending.popleft())
+        
+        except Exception as e:
+            logger.error(f"Error in process_conversation stream: {str(e)}")
+            return
+        finally:
+            # Drop synthesis queued for a client that went away mid-stream
+            for future in pending:
+                future.cancel()
+        
+        end_time = time.perf_counter_ns()
+        response_text = "".join(response_parts)
+        if cached_response is None:
+            llm_cache.put(transcription, response_text)
         
         # Calculate LLM metrics
-        llm_latency = llm_end - llm_start
-        groq_latency = groq_end - groq_start
-        ttft = time.time() - llm_start
-        
-        llm_metrics = {
-            "timestamp": datetime.now().isoformat(),
-            "type": "llm",
-            "total_latency": round(llm_latency * 1000, 2),  # ms
-            "service_latency": round(groq_latency * 1000, 2),  # ms
-            "processing_overhead": round((llm_latency - groq_latency) * 1000, 2),  # ms
-            "ttft": True,  # Simplified
-            "tokens": groq_response.usage.completion_tokens if hasattr(groq_response, 'usage') else None,
-        }
-        metrics_log.append(llm_metrics)
-        
-        # 3. Text-to-Speech
-        tts_start = time.time()
-        
-        # Call ElevenLabs API
-        elevenlabs_start = time.time()
-        response = elevenlabs_client.generate(
-            text=response_text,
-            voice=ELEVENLABS_VOICE_ID,
-            model_id="eleven_multilingual_v2",
-            output_format="mp3_22050_32"
+        llm_latency = groq_end - llm_start
+        llm_metrics = stage_metrics(
+            "llm", llm_latency, llm_latency, timestamp,
+            ttft=ttft is not None,
+            tokens=llm_usage.get("completion_tokens"),
+            cache_hit=cached_response is not None,
+            cached_tokens=llm_usage.get("cached_tokens"),
         )
-        audio = response  # Get the binary audio content
-        elevenlabs_end = time.time()
-        
-        # Convert audio to base64 for sending via JSON
-        audio_base64 = base64.b64encode(audio).decode('utf-8')
-        tts_end = time.time()
-        
-        # Calculate TTS metrics
-        tts_latency = tts_end - tts_start
-        elevenlabs_latency = elevenlabs_end - elevenlabs_start
-        
-        tts_metrics = {
-            "timestamp": datetime.now().isoformat(),
-            "type": "tts",
-            "total_latency": round(tts_latency * 1000, 2),  # ms
-            "service_latency": round(elevenlabs_latency * 1000, 2),  # ms
-            "processing_overhead": round((tts_latency - elevenlabs_latency) * 1000, 2),  # ms
-            "text_length": len(response_text),
-        }
-        metrics_log.append(tts_metrics)
-        ttfb = time.time() - start_time
+        record_metric(llm_metrics)
+        
+        # Calculate TTS metrics; service latency is the first sentence's time to
+        # first audio chunk (later sentences are synthesized concurrently with it)
+        tts_latency = end_time - (tts_start or end_time)
+        tts_metrics = stage_metrics(
+            "tts", tts_latency, elevenlabs_latency or 0, timestamp,
+            text_length=len(response_text),
+            tts_cache_hits=tts_cache_hits,
+        )
+        record_metric(tts_metrics)
         
         # Calculate total latency
-        end_time = time.time()
         total_latency = end_time - start_time
         
         # Compile all metrics
         full_metrics = {
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": timestamp,
             "type": "conversation",
-            "total_latency": round(total_latency * 1000, 2),  # ms
-            "eou_delay": round(eou_time * 1000, 2),  # ms
-            "ttft": round(ttft * 1000, 2),  # ms
-            "ttfb": round(ttfb * 1000, 2),  # ms
+            "total_latency": total_latency // NS_PER_MS,  # ms
+            "eou_delay": eou_time // NS_PER_MS,  # ms
+            "ttft": (ttft or 0) // NS_PER_MS,  # ms
+            "ttfb": (ttfb or 0) // NS_PER_MS,  # ms
             "stt_latency": stt_metrics['total_latency'],
             "llm_latency": llm_metrics['total_latency'],
             "tts_latency": tts_metrics['total_latency'],
             "text_length": len(response_text),
-        }
-        metrics_log.append(full_metrics)
-        
-        return jsonify({
-            "transcription": transcription,
             "response": response_text,
-            "audio": audio_base64,
-            "metrics": full_metrics
-        })
+        }
+        record_metric(full_metrics)
     
-    except Exception as e:
-        logger.error(f"Error in process_conversation: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+    # The transcription is known before any audio is sent, so it travels in a
+    # header; the reply text is only complete once the stream finishes, so it is
+    # recorded with the turn's metrics (see /metrics) rather than sent back
+    return Response(
+        generate_audio(),
+        mimetype='audio/mpeg',
+        headers={"X-Transcription": quote(transcription)},
+    )
 
 @app.route('/', methods=['GET'])
 def index():
     return "VoiceFlow AI Flask Backend is running!"
 
 if __name__ == '__main__':
+    # Development server only; run `gunicorn app:app` (see gunicorn.conf.py) in production
     port = int(os.environ.get('PORT', 5000))
     app.run(debug=True, host='0.0.0.0', port=port)
\ No newline at end of file
@@ -0,0 +1,201 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Semantic matching is optional; without fastembed the cache serves exact matches only
+try:
+    from fastembed import TextEmbedding
+    FASTEMBED_AVAILABLE = True
+except ImportError:
+    FASTEMBED_AVAILABLE = False
+
+# Optional on-disk tier for synthesized audio, so it survives restarts
+try:
+    import diskcache
+    DISKCACHE_AVAILABLE = True
+except ImportError:
+    DISKCACHE_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+MISS_EMBEDDINGS_MAXLEN = 64
+
+def normalize_text(text):
+    """Lowercase and collapse whitespace so trivially different utterances share a key"""
+    return " ".join(text.lower().split())
+
+class SemanticResponseCache:
+    """LRU cache of LLM replies keyed by the user's utterance
+
+    Exact matches on the normalized utterance are always served. When fastembed
+    is installed, an utterance whose embedding has a cosine similarity of at
+    least `threshold` with a cached one is served as well. With a `ttl`,
+    replies expire that many seconds after they are cached.
+    """
+
+    def __init__(self, max_entries=1024, threshold=0.92, model_name=EMBEDDING_MODEL, ttl=None):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.model_name = model_name
+        self.ttl = ttl
+        self._entries = OrderedDict()  # normalized text -> (embedding, response, expiry)
+        self._miss_embeddings = OrderedDict()  # normalized text -> embedding, reused by put()
+        self._lock = threading.Lock()
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._semantic = FASTEMBED_AVAILABLE
+
+    @property
+    def semantic(self):
+        """Whether lookups embed the utterance, which makes them CPU-bound"""
+        return self._semantic
+
+    def _embed(self, text):
+        """Return a unit-length embedding for text, or None if semantic matching is off"""
+        if not self._semantic:
+            return None
+        try:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = TextEmbedding(model_name=self.model_name)
+                vector = next(iter(self._model.embed([text])))
+        except Exception as e:
+            logger.error(f"Disabling semantic response cache: {e}")
+            self._semantic = False
+            return None
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def _expire(self):
+        """Drop expired replies; the caller holds the lock"""
+        now = time.monotonic()
+        for key in [k for k, (_, _, expiry) in self._entries.items() if expiry < now]:
+            del self._entries[key]
+
+    def get(self, text):
+        """Return the cached reply for text, or None on a miss"""
+        key = normalize_text(text)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] >= time.monotonic():
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        embedding = self._embed(key)
+        if embedding is None:
+            return None
+
+        with self._lock:
+            self._miss_embeddings[key] = embedding
+            while len(self._miss_embeddings) > MISS_EMBEDDINGS_MAXLEN:
+                self._miss_embeddings.popitem(last=False)
+            if self.ttl is not None:
+                self._expire()
+            keys = [k for k, (vector, _, _) in self._entries.items() if vector is not None]
+            if not keys:
+                return None
+            scores = np.stack([self._entries[k][0] for k in keys]) @ embedding
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+            self._entries.move_to_end(keys[best])
+            return self._entries[keys[best]][1]
+
+    def put(self, text, response):
+        """Cache response as the reply to text"""
+        key = normalize_text(text)
+        with self._lock:
+            embedding = self._miss_embeddings.pop(key, None)
+        if embedding is None:
+            embedding = self._embed(key)
+        expiry = time.monotonic() + self.ttl if self.ttl is not None else float("inf")
+        with self._lock:
+            self._entries[key] = (embedding, response, expiry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+def audio_cache_key(voice_id, model_id, output_format, text):
+    """Stable key for the audio of text spoken by a voice/model pair in one output format"""
+    key = f"{voice_id}|{model_id}|{output_format}|{text}"
+    return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+class AudioCache:
+    """LRU cache of synthesized audio bytes
+
+    When a directory is given and diskcache is installed, entries are also
+    written to disk, so audio evicted from memory or lost on restart can still
+    be served without calling the TTS provider.
+    """
+
+    def __init__(self, max_entries=1024, directory=None):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> audio bytes
+        self._lock = threading.Lock()
+        self._disk = diskcache.Cache(directory) if directory and DISKCACHE_AVAILABLE else None
+
+    def _remember(self, key, audio):
+        with self._lock:
+            self._entries[key] = audio
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key):
+        """Return the cached audio for key, or None on a miss"""
+        with self._lock:
+            audio = self._entries.get(key)
+            if audio is not None:
+                self._entries.move_to_end(key)
+                return audio
+
+        if self._disk is not None:
+            audio = self._disk.get(key)
+            if audio is not None:
+                self._remember(key, audio)
+                return audio
+        return None
+
+    def put(self, key, audio):
+        """Cache audio under key"""
+        self._remember(key, audio)
+        if self._disk is not None:
+            self._disk.set(key, audio)
+
+def audio_digest(audio_data):
+    """Short fingerprint of an audio buffer, for spotting duplicate uploads"""
+    return hashlib.blake2b(audio_data, digest_size=16).digest()
+
+class RecentResults:
+    """LRU cache whose entries expire `ttl` seconds after they are stored"""
+
+    def __init__(self, ttl=10.0, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expiry, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the value stored under key, or None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value):
+        """Store value under key for the next `ttl` seconds"""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -0,0 +1,22 @@
+import os
+import multiprocessing
+from datetime import datetime
+
+# Production server settings: `gunicorn app:app` picks this file up automatically.
+# Threaded workers let the blocking Deepgram/Groq/ElevenLabs calls of concurrent
+# requests overlap instead of queuing behind each other.
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+keepalive = 65
+
+# Keep per-request INFO logging off the request path unless asked for
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+# Workers name their metrics logs after one shared session, so an export can
+# gather the logs of every worker
+os.environ.setdefault("METRICS_SESSION", datetime.now().strftime("%Y%m%d_%H%M%S"))
+
+# Conversation turns stream audio for several seconds; don't kill them early
+timeout = 120
@@ -0,0 +1,73 @@
+import asyncio
+import logging
+
+from livekit import rtc
+from livekit.agents import AutoSubscribe, JobContext, WorkerOptions, cli
+
+from agent_helpers import (
+    LiveTranscriber,
+    close_async_clients,
+    prewarm_tts_cache,
+    respond_to_speech,
+)
+
+logger = logging.getLogger(__name__)
+
+# The agent hears and speaks 16 kHz mono PCM16 in 20 ms frames, the format
+# agent_helpers streams to Deepgram and receives from ElevenLabs
+SAMPLE_RATE = 16000
+NUM_CHANNELS = 1
+FRAME_MS = 20
+
+async def entrypoint(ctx: JobContext):
+    """Hold a voice conversation with the first participant to join the room"""
+    # Synthesize the fallback phrases while the room connects, so an apology
+    # never waits on ElevenLabs (which is often what just failed)
+    prewarm = asyncio.create_task(prewarm_tts_cache())
+
+    await ctx.connect(auto_subscribe=AutoSubscribe.AUDIO_ONLY)
+    participant = await ctx.wait_for_participant()
+
+    source = rtc.AudioSource(SAMPLE_RATE, NUM_CHANNELS)
+    track = rtc.LocalAudioTrack.create_audio_track("agent-voice", source)
+    options = rtc.TrackPublishOptions(source=rtc.TrackSource.SOURCE_MICROPHONE)
+    await ctx.room.local_participant.publish_track(track, options)
+
+    transcriber = LiveTranscriber(SAMPLE_RATE, NUM_CHANNELS)
+    ctx.add_shutdown_callback(transcriber.close)
+    ctx.add_shutdown_callback(close_async_clients)
+
+    # Each turn reads the microphone from its own queue; audio arriving while
+    # the agent is speaking goes to the finished turn's queue and is dropped
+    listening = asyncio.Queue()
+
+    async def capture_microphone():
+        stream = rtc.AudioStream.from_participant(
+            participant=participant,
+            track_source=rtc.TrackSource.SOURCE_MICROPHONE,
+            sample_rate=SAMPLE_RATE,
+            num_channels=NUM_CHANNELS,
+            frame_size_ms=FRAME_MS,
+        )
+        async for event in stream:
+            listening.put_nowait(bytes(event.frame.data))
+
+    async def turn_frames(queue):
+        while True:
+            yield await queue.get()
+
+    async def stop_capture():
+        capture.cancel()
+
+    capture = asyncio.create_task(capture_microphone())
+    ctx.add_shutdown_callback(stop_capture)
+    await prewarm
+
+    while True:
+        reply = respond_to_speech(turn_frames(listening), SAMPLE_RATE, NUM_CHANNELS, transcriber=transcriber)
+        async for chunk in reply:
+            await source.capture_frame(rtc.AudioFrame(chunk, SAMPLE_RATE, NUM_CHANNELS, len(chunk) // 2))
+        listening = asyncio.Queue()
+
+if __name__ == "__main__":
+    cli.run_app(WorkerOptions(entrypoint_fnc=entrypoint))
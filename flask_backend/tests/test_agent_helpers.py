@@ -0,0 +1,294 @@
+import asyncio
+import os
+import unittest
+from types import SimpleNamespace as NS
+from unittest import mock
+
+import orjson
+from websockets.asyncio.server import serve
+
+# The provider clients are built at import; the fakes below replace their calls
+for name in ("DEEPGRAM_API_KEY", "ELEVENLABS_API_KEY", "GROQ_API_KEY"):
+    os.environ.setdefault(name, "test")
+
+import agent_helpers
+from agent_helpers import (
+    ERROR_PHRASE,
+    NOT_HEARD_PHRASE,
+    NOT_UNDERSTOOD_PHRASE,
+    PCM_FRAME_BYTES,
+    TTS_CONCURRENCY,
+)
+from caching import AudioCache, RecentResults, SemanticResponseCache
+
+def speech_for(text):
+    """The PCM the fake ElevenLabs returns for text: 1000 bytes, so it splits unevenly into frames"""
+    return text.encode().ljust(1000, b".")
+
+async def audio_frames(count, delay=0.01):
+    for _ in range(count):
+        await asyncio.sleep(delay)
+        yield bytes(PCM_FRAME_BYTES)
+
+async def collect(chunks):
+    return b"".join([bytes(chunk) async for chunk in chunks])
+
+def deepgram_result(transcript, speech_final=False, from_finalize=False):
+    return orjson.dumps({
+        "type": "Results",
+        "is_final": True,
+        "speech_final": speech_final,
+        "from_finalize": from_finalize,
+        "channel": {"alternatives": [{"transcript": transcript}]},
+    }).decode()
+
+class FakeProvidersTestCase(unittest.IsolatedAsyncioTestCase):
+    """Replaces Deepgram's REST endpoint, Groq and ElevenLabs with in-process fakes"""
+
+    reply = "Hi there. How can I help? Bye"
+
+    async def asyncSetUp(self):
+        self.transcript = "hello there"
+        self.stt_calls = []
+        self.llm_calls = []
+        self.tts_calls = []
+        self.tts_active = 0
+        self.tts_peak = 0
+        self.llm_error = None
+
+        llm_cache = SemanticResponseCache()
+        llm_cache._semantic = False  # Exact matches only, whether or not fastembed is installed
+        completions = NS(create=self.fake_completion)
+        for name, value in {
+            "deepgram_listen_async": self.fake_deepgram_listen,
+            "groq_async_client": NS(chat=NS(completions=completions)),
+            "elevenlabs_stream_async": self.fake_tts,
+            "llm_cache": llm_cache,
+            "tts_cache": AudioCache(),
+            "recent_transcripts": RecentResults(),
+        }.items():
+            patcher = mock.patch.object(agent_helpers, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def fake_deepgram_listen(self, content, content_type, **params):
+        if not isinstance(content, bytes):
+            content = b"".join([chunk async for chunk in content])
+        self.stt_calls.append((content, content_type, params))
+        await asyncio.sleep(0.05)
+        return self.transcript
+
+    async def fake_completion(self, messages, stream=False, **options):
+        self.llm_calls.append(messages)
+        if self.llm_error is not None:
+            raise self.llm_error
+        if not stream:
+            return NS(choices=[NS(message=NS(content=self.reply))])
+
+        async def chunks():
+            first, *rest = self.reply.split(" ")
+            for token in [first, *(" " + word for word in rest)]:
+                await asyncio.sleep(0)
+                yield NS(choices=[NS(delta=NS(content=token))])
+            yield NS(choices=[])
+        return chunks()
+
+    async def fake_tts(self, voice_id, text, model_id, output_format):
+        self.tts_calls.append(text)
+        self.tts_active += 1
+        self.tts_peak = max(self.tts_peak, self.tts_active)
+        try:
+            audio = speech_for(text)
+            for start in range(0, len(audio), 300):
+                await asyncio.sleep(0.01)
+                yield audio[start:start + 300]
+        finally:
+            self.tts_active -= 1
+
+class TranscribeAudioDataTests(FakeProvidersTestCase):
+
+    async def test_duplicate_uploads_share_one_request(self):
+        results = await asyncio.gather(*(agent_helpers.transcribe_audio_data(b"audio") for _ in range(4)))
+        self.assertEqual(results, ["hello there"] * 4)
+        self.assertEqual(len(self.stt_calls), 1)
+        self.assertEqual(agent_helpers.stt_inflight_async, {})
+
+    async def test_cancelled_caller_does_not_fail_duplicates(self):
+        first = asyncio.create_task(agent_helpers.transcribe_audio_data(b"audio"))
+        await asyncio.sleep(0.01)
+        duplicates = [asyncio.create_task(agent_helpers.transcribe_audio_data(b"audio")) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        first.cancel()
+        results = await asyncio.gather(first, *duplicates, return_exceptions=True)
+        self.assertIsInstance(results[0], asyncio.CancelledError)
+        self.assertEqual(results[1:], ["hello there"] * 2)
+        self.assertEqual(len(self.stt_calls), 1)
+
+    async def test_transcribe_pcm_streams_the_chunks(self):
+        chunks = [memoryview(b"a" * 640), b"b" * 100]
+        transcript = await agent_helpers.transcribe_pcm(chunks, 8000, encoding="mulaw")
+        self.assertEqual(transcript, "hello there")
+        content, _, params = self.stt_calls[0]
+        self.assertEqual(content, b"a" * 640 + b"b" * 100)
+        self.assertEqual(params, {"encoding": "mulaw", "sample_rate": 8000, "channels": 1})
+
+class LlmTests(FakeProvidersTestCase):
+
+    async def test_get_llm_response_replays_cached_reply(self):
+        self.assertEqual(await agent_helpers.get_llm_response("Hello there"), self.reply)
+        self.assertEqual(await agent_helpers.get_llm_response("hello  THERE"), self.reply)
+        self.assertEqual(len(self.llm_calls), 1)
+
+    async def test_stream_llm_response_caches_the_complete_reply(self):
+        tokens = [token async for token in agent_helpers.stream_llm_response("hello")]
+        self.assertGreater(len(tokens), 1)
+        cached = [token async for token in agent_helpers.stream_llm_response("hello")]
+        self.assertEqual(cached, ["".join(tokens)])
+        self.assertEqual(len(self.llm_calls), 1)
+
+class SynthesisTests(FakeProvidersTestCase):
+
+    async def test_synthesize_speech_caches_audio(self):
+        self.assertEqual(await agent_helpers.synthesize_speech("Hi."), speech_for("Hi."))
+        self.assertEqual(await agent_helpers.synthesize_speech("Hi."), speech_for("Hi."))
+        self.assertEqual(self.tts_calls, ["Hi."])
+
+    async def test_synthesize_speech_stream_yields_whole_frames(self):
+        for _ in range(2):  # Synthesized, then replayed from the cache
+            frames = [bytes(frame) async for frame in agent_helpers.synthesize_speech_stream("Hi.")]
+            self.assertEqual([len(frame) for frame in frames], [640, 360])
+            self.assertEqual(b"".join(frames), speech_for("Hi."))
+        self.assertEqual(self.tts_calls, ["Hi."])
+
+    async def test_prewarm_tts_cache_serves_canned_phrases_without_synthesis(self):
+        await agent_helpers.prewarm_tts_cache()
+        self.tts_calls.clear()
+        for phrase in agent_helpers.CANNED_PHRASES:
+            self.assertEqual(await collect(agent_helpers.synthesize_speech_stream(phrase)), speech_for(phrase))
+        self.assertEqual(self.tts_calls, [])
+
+    async def test_close_async_clients_closes_the_shared_client(self):
+        client = mock.AsyncMock()
+        with mock.patch.object(agent_helpers, "async_http_client", client):
+            await agent_helpers.close_async_clients()
+        client.aclose.assert_awaited_once()
+
+class FakeTranscriber:
+    def __init__(self, transcript=None, error=None):
+        self.transcript = transcript
+        self.error = error
+
+    async def transcribe(self, frames):
+        async for _ in frames:
+            pass
+        if self.error is not None:
+            raise self.error
+        return self.transcript
+
+class RespondToSpeechTests(FakeProvidersTestCase):
+
+    async def respond(self, transcriber):
+        return await collect(agent_helpers.respond_to_speech(audio_frames(3), 16000, transcriber=transcriber))
+
+    async def test_reply_is_spoken_in_sentence_order(self):
+        audio = await self.respond(FakeTranscriber("hello there"))
+        sentences = ["Hi there.", "How can I help?", "Bye"]
+        self.assertEqual(audio, b"".join(speech_for(sentence) for sentence in sentences))
+
+    async def test_synthesis_concurrency_is_bounded(self):
+        self.reply = " ".join(f"Sentence {i}." for i in range(8))
+        await self.respond(FakeTranscriber("hello there"))
+        self.assertEqual(len(self.tts_calls), 8)
+        self.assertLessEqual(self.tts_peak, TTS_CONCURRENCY)
+
+    async def test_no_speech_gets_not_heard_phrase(self):
+        self.assertEqual(await self.respond(FakeTranscriber("")), speech_for(NOT_HEARD_PHRASE))
+
+    async def test_failed_transcription_gets_not_understood_phrase(self):
+        audio = await self.respond(FakeTranscriber(error=OSError("socket closed")))
+        self.assertEqual(audio, speech_for(NOT_UNDERSTOOD_PHRASE))
+
+    async def test_llm_failure_gets_error_phrase(self):
+        self.llm_error = RuntimeError("groq down")
+        self.assertEqual(await self.respond(FakeTranscriber("hello there")), speech_for(ERROR_PHRASE))
+
+class FakeDeepgramStream:
+    """A local stand-in for Deepgram's streaming endpoint
+
+    `script` maps a frame count to the message sent once that many audio
+    frames have arrived on the connection.
+    """
+
+    def __init__(self, script=None, reply_to_finalize=True):
+        self.script = script or {}
+        self.reply_to_finalize = reply_to_finalize
+        self.connections = 0
+        self.frames = 0
+        self.messages = []
+
+    async def handler(self, ws):
+        self.connections += 1
+        async for message in ws:
+            if isinstance(message, bytes):
+                self.frames += 1
+                if self.frames in self.script:
+                    await ws.send(self.script[self.frames])
+                continue
+            kind = orjson.loads(message)["type"]
+            self.messages.append(kind)
+            if kind == "Finalize" and self.reply_to_finalize:
+                await ws.send(deepgram_result(f"final{self.frames}", from_finalize=True))
+            elif kind == "CloseStream":
+                await ws.close()
+                return
+
+class LiveTranscriberTests(unittest.IsolatedAsyncioTestCase):
+
+    async def start(self, stream):
+        server = await serve(stream.handler, "127.0.0.1", 0)
+        self.addAsyncCleanup(server.wait_closed)
+        self.addCleanup(server.close)
+        port = server.sockets[0].getsockname()[1]
+        patcher = mock.patch.object(agent_helpers, "DEEPGRAM_LISTEN_URL", f"ws://127.0.0.1:{port}/v1/listen")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_turns_reuse_one_connection(self):
+        stream = FakeDeepgramStream()
+        await self.start(stream)
+        transcriber = agent_helpers.LiveTranscriber(16000)
+        self.assertEqual(await transcriber.transcribe(audio_frames(3)), "final3")
+        self.assertEqual(await transcriber.transcribe(audio_frames(2)), "final5")
+        await transcriber.close()
+        self.assertEqual(stream.connections, 1)
+        self.assertEqual(stream.messages, ["Finalize", "Finalize", "CloseStream"])
+
+    async def test_endpointed_turn_is_drained_before_the_next(self):
+        stream = FakeDeepgramStream({2: deepgram_result("hello", speech_final=True)})
+        await self.start(stream)
+        transcriber = agent_helpers.LiveTranscriber(16000)
+        self.assertEqual(await transcriber.transcribe(audio_frames(20)), "hello")
+        # The flush reply to the first turn must not end the second one
+        transcript = await transcriber.transcribe(audio_frames(2))
+        self.assertEqual(transcript, f"final{stream.frames}")
+        await transcriber.close()
+        self.assertEqual(stream.connections, 1)
+
+    async def test_missing_finalize_reply_times_out(self):
+        stream = FakeDeepgramStream({1: deepgram_result("partial")}, reply_to_finalize=False)
+        await self.start(stream)
+        transcriber = agent_helpers.LiveTranscriber(16000)
+        with mock.patch.object(agent_helpers, "DEEPGRAM_FINALIZE_TIMEOUT", 0.2):
+            transcript = await asyncio.wait_for(transcriber.transcribe(audio_frames(2)), 5)
+        self.assertEqual(transcript, "partial")
+        self.assertIsNone(transcriber._ws)  # Not reused for the next turn
+
+    async def test_transcribe_stream_closes_its_connection(self):
+        stream = FakeDeepgramStream()
+        await self.start(stream)
+        transcript = await agent_helpers.transcribe_stream(audio_frames(3), 8000, encoding="mulaw")
+        self.assertEqual(transcript, "final3")
+        self.assertEqual(stream.messages, ["Finalize", "CloseStream"])
+
+if __name__ == "__main__":
+    unittest.main()